@@ -1,4 +1,6 @@
 import os
+import functools
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 
@@ -6,16 +8,75 @@ import h5py
 import psutil
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from lightning.pytorch import LightningDataModule
 from torch.utils.data import DataLoader
 
-from dataclasses import dataclass, field, fields
+from dataclasses import dataclass, field, fields, MISSING
 from typing import List, Optional, Union, IO, Any, Dict
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass # e.g. NaN/Infinity literals, which only the stdlib parser accepts
+    return json.loads(data)
+
+
+def _abs_path(path):
+    # cache keys must not depend on the working directory; join only when the path is relative
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.getcwd(), path)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_config_json(path, mtime):
+    '''
+    Parse a json config file. Cached by (path, mtime) so repeated loads of the same file skip the parse;
+    callers must copy the returned dict before mutating it.
+    '''
+    with open(path, 'rb') as f:
+        return _json_loads(f.read())
+
+def _stat_exists(path):
+    # a single os.stat, not cached: validate() runs once per use, and a cache would miss deleted files
+    try:
+        os.stat(path)
+    except OSError:
+        return False
+    return True
+
+
+def _copy_value(value):
+    # config fields are immutable scalars except for containers, which get a shallow copy
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+_VALID_DATASET_CLASSES = frozenset(["MaskDataset", "SampleDataset"])
+_DATASET_CLASS_REGISTRY = {}
+
+def _get_dataset_cls(dataset_class):
+    # resolve the dataset class by name once, instead of eval() on every datamodule
+    if dataset_class not in _DATASET_CLASS_REGISTRY:
+        if dataset_class not in _VALID_DATASET_CLASSES:
+            raise(ValueError(f"dataset_class must be one of {sorted(_VALID_DATASET_CLASSES)}"))
+        _DATASET_CLASS_REGISTRY[dataset_class] = globals()[dataset_class]
+    return _DATASET_CLASS_REGISTRY[dataset_class]
+
 print("Warning: do you really want to use this dataset? It's suggested to use dataset from fine-tune part")
-@dataclass
+@dataclass(slots=True)
 class DatasetConfig:
     
     hdf5_file: Union[str, IO]
@@ -46,6 +107,18 @@ class DatasetConfig:
 
     dataset_class: str = "MaskDataset"
 
+    fetch_factor: int = 1 # minibatches gathered per block fetch; if > 1, batches are drawn from shuffled contiguous row blocks
+    block_size: int = 16 # rows per contiguous block, only used if fetch_factor > 1
+    hdf5_row_cache_size: int = 0 # signal rows kept in an in-memory LRU cache per dataset (and per worker); 0 disables it
+
+    num_workers: int = 0 # number of DataLoader worker processes
+    persistent_workers: bool = True # keep workers alive between epochs, only used if num_workers > 0
+    prefetch_factor: int = 4 # batches prefetched by each worker, only used if num_workers > 0
+
+    normal_vocab_ids: List[int] = field(default_factory=list, init=False, repr=False, compare=False) # derived from vocab_shift and vocab_levels
+    special_vocab_ids: List[int] = field(default_factory=list, init=False, repr=False, compare=False) # derived from vocab_shift
+    _dirty: bool = field(default=True, init=False, repr=False, compare=False) # whether validate() has to run again
+
 
     def __init__(self, config: Union[str, Dict[str, Any], "DatasetConfig"] = None, **kwargs: Any):
         '''
@@ -70,86 +143,131 @@ class DatasetConfig:
         position_id_cls: int = 0
         position_id_pad: int = 0
         deterministic: bool = False # whether to set random seed
+        fetch_factor: int = 1 # minibatches gathered per block fetch; if > 1, batches are drawn from shuffled contiguous row blocks
+        block_size: int = 16 # rows per contiguous block, only used if fetch_factor > 1
+        hdf5_row_cache_size: int = 0 # signal rows kept in an in-memory LRU cache per dataset (and per worker); 0 disables it
+        num_workers: int = 0 # number of DataLoader worker processes
+        persistent_workers: bool = True # keep workers alive between epochs, only used if num_workers > 0
+        prefetch_factor: int = 4 # batches prefetched by each worker, only used if num_workers > 0
     '''
-        self.hdf5_file = None
+        for key, value in self._DEFAULTS.items():
+            setattr(self, key, value)
 
         self.load(config, kwargs)
 
-        self.update(**kwargs)
-
         self.normal_vocab_ids = []
         self.special_vocab_ids = []
         self.__init__vocabs__()
 
-        self.validate()
+        self._dirty = True
             
     def validate(self):
+        # validation is deferred until the config is used to build a dataset or dataloader
+        if not self._dirty or os.environ.get("CHROMBERT_SKIP_VALIDATE") == "1":
+            return
 
-        dataset_classes = ["MaskDataset" , "SampleDataset"]
-        if self.dataset_class not in dataset_classes:
-            raise(ValueError(f"dataset_class must be one of {dataset_classes}"))
+        if self.dataset_class not in _VALID_DATASET_CLASSES:
+            raise(ValueError(f"dataset_class must be one of {sorted(_VALID_DATASET_CLASSES)}"))
+        for key in self._FILE_FIELDS:
+            if key == "ignore_gsmids" and not self.ignore_factor:
+                continue # only read when ignore_factor is set
+            value = getattr(self, key)
+            if isinstance(value, str) and not _stat_exists(value):
+                raise(FileNotFoundError(f"{key} {value} does not exist"))
+        self._dirty = False
 
 
     def load(self,config, kwargs = None):
+        self._dirty = True
+        kwargs = {} if kwargs is None else kwargs
         if config is None :
             if "hdf5_file" not in kwargs:
                 raise(TypeError("hdf5_file file must be provided"))
-            else:
-                self.update(**kwargs)
+            config = {}
+        
+        if isinstance(config, DatasetConfig):
+            # trusted in-process instance: copy its fields without per-key checks or a to_dict() copy
+            for key in self._FIELD_NAMES:
+                setattr(self, key, getattr(config, key))
+            config = {}
         
         if isinstance(config, str):  
-            with open(config, 'r') as f:
-                config = json.load(f)
-            if "hdf5_file" in config:
-                self.hdf5_file = config["hdf5_file"]  
+            config = _abs_path(config)
+            config = {k: _copy_value(v) for k, v in _load_config_json(config, os.path.getmtime(config)).items()}
                 
-        if isinstance(config, Union[dict, DatasetConfig]):  
-            for key, value in config.items():
-                if hasattr(self, key):
-                    setattr(self, key, value)
-                else:
-                    raise(AttributeError(f"Warning: '{key}' is not a valid field name in DatasetConfig"))
+        if not isinstance(config, dict):
+            raise(TypeError(f"config must be a str, dict, or DatasetConfig, but got {type(config)}"))
+
+        # kwargs override config values; the merged dict checks and sets every key once
+        for key, value in (config | kwargs).items():
+            if key in self._FIELDS:
+                setattr(self, key, value)
+            else:
+                raise(AttributeError(f"Warning: '{key}' is not a valid field name in DatasetConfig"))
     
     def update(self, **kwargs):
+        if not self._VALIDATED_FIELDS.isdisjoint(kwargs):
+            self._dirty = True
         for key, value in kwargs.items():
-            if hasattr(self, key):
+            if key in self._FIELDS:
                 setattr(self, key, value)
             else:
                 raise(AttributeError(f"Warning: '{key}' is not a valid field name in DatasetConfig"))
 
 
     def save(self, config_file: str):
-        values = self.__dict__()
+        values = {key: getattr(self, key) for key in self._FIELD_NAMES}
         with open(config_file, 'w') as f:
             json.dump(values, f, indent=4)
 
     def __repr__(self):
-        values = self.__dict__()
-        return f"DatasetConfig({values})"
+        values = ", ".join(f"{key!r}: {getattr(self, key)!r}" for key in self._FIELD_NAMES)
+        return f"DatasetConfig({{{values}}})"
     
     def __str__(self):
-        values = self.__dict__()
+        # serialized straight from the fields, no intermediate copy
+        values = {key: getattr(self, key) for key in self._FIELD_NAMES}
         return json.dumps(values, indent=4)
     
-    def __dict__(self):
-        return {f.name: getattr(self, f.name) for f in fields(self)}
+    def to_dict(self):
+        return {key: _copy_value(getattr(self, key)) for key in self._FIELD_NAMES}
     
     def items(self):
-        return self.__dict__().items()
+        return self.to_dict().items()
     
     def __init__vocabs__(self):
         self.normal_vocab_ids = list(range(self.vocab_shift,self.vocab_levels + self.vocab_shift))
         self.special_vocab_ids = list(range(self.vocab_shift))
         return None
     
-    def clone(self):
-        return DatasetConfig(config = self)
+    @classmethod
+    def _copy_from(cls, config):
+        # copy an existing config without going through load(); its validation state is kept
+        dc = object.__new__(cls)
+        for key in cls.__slots__:
+            setattr(dc, key, _copy_value(getattr(config, key)))
+        return dc
+
+    def clone(self, **kwargs):
+        dc = DatasetConfig._copy_from(self)
+        if kwargs:
+            dc.update(**kwargs)
+            if "vocab_shift" in kwargs or "vocab_levels" in kwargs:
+                dc.__init__vocabs__()
+        return dc
+
+DatasetConfig._FIELD_NAMES = tuple(f.name for f in fields(DatasetConfig) if f.init)
+DatasetConfig._FIELDS = frozenset(DatasetConfig._FIELD_NAMES)
+DatasetConfig._FILE_FIELDS = frozenset(["hdf5_file", "ignore_gsmids"]) # fields that may hold a file path
+DatasetConfig._VALIDATED_FIELDS = frozenset(["dataset_class", "ignore_factor"]) | DatasetConfig._FILE_FIELDS # fields checked by validate()
+DatasetConfig._DEFAULTS = {f.name: None if f.default is MISSING else f.default for f in fields(DatasetConfig) if f.init}
 
 
 class BasicDataset(Dataset):
     def __init__(self, mode= "train", config = None, **params: Any):
         self.mode = mode
         self.config = DatasetConfig(config, **params)
+        self.config.validate()
        
         if isinstance(self.config.hdf5_file, str):
             self.dataset = None
@@ -168,15 +286,63 @@ class BasicDataset(Dataset):
             self.region = f[f'/{self.mode}/region'][:]
             self.ratios = f[f'/{self.mode}/ratio'][:]
             self.high_ratios = np.sum(self.ratios[:, 2:], axis=1) # sum of high occupancy regions
+        self.block_reads = False # set by init_dataloader when batches come from a BlockBatchSampler
+        self._block_buffer = OrderedDict()
+        self._row_cache = OrderedDict()
 
                       
     def __len__(self):
         return self.len
 
+    def _raw_index(self, index):
+        return index
+
+    def _read_signal(self, raw_index):
+        if self._block_buffer:
+            block = raw_index // self.config.block_size
+            if block in self._block_buffer:
+                return self._block_buffer[block][raw_index - block * self.config.block_size].copy()
+        return self.dataset['signal'][raw_index, :]
+
+    def _fetch_signal(self, raw_index):
+        # rows come from the LRU row cache, then the buffered row blocks, then the hdf5 file
+        raw_index = int(raw_index)
+        # cached rows are returned as copies, so callers can modify input_ids without touching the cache
+        if raw_index in self._row_cache:
+            self._row_cache.move_to_end(raw_index)
+            return self._row_cache[raw_index].copy()
+        row = self._read_signal(raw_index)
+        if self.config.hdf5_row_cache_size > 0:
+            self._row_cache[raw_index] = row
+            if len(self._row_cache) > self.config.hdf5_row_cache_size:
+                self._row_cache.popitem(last=False)
+            return row.copy()
+        return row
+
+    def __getitems__(self, indices):
+        # with block_reads, the row blocks a minibatch touches are read as whole contiguous hdf5 slices and kept
+        # for the rest of the fetch, so a fetch costs about batch_size * fetch_factor / block_size reads;
+        # randomly ordered minibatches would read a block per row instead, so they keep the per-row path
+        if not self.block_reads or self.config.fetch_factor <= 1:
+            return [self[index] for index in indices]
+        if self.dataset is None:
+            self.dataset = h5py.File(self.config.hdf5_file, 'r')[f"/{self.mode}"]
+        block_size = self.config.block_size
+        # resampled rows may spread a fetch over more raw blocks, hence the slack
+        block_limit = 2 * -(-self.config.batch_size * self.config.fetch_factor // block_size) + 2
+        for block in np.unique([int(self._raw_index(index)) // block_size for index in indices]).tolist():
+            if block in self._block_buffer:
+                self._block_buffer.move_to_end(block)
+                continue
+            self._block_buffer[block] = self.dataset['signal'][block * block_size:min((block + 1) * block_size, self.len), :]
+            if len(self._block_buffer) > block_limit:
+                self._block_buffer.popitem(last=False)
+        return [self[index] for index in indices]
+
     def __getitem__(self, index):
         if self.dataset is None:
             self.dataset = h5py.File(self.config.hdf5_file, 'r')[f"/{self.mode}"]
-        data = torch.from_numpy(self.dataset['signal'][index, :])   
+        data = torch.from_numpy(self._fetch_signal(index))
         gsmid = torch.from_numpy(self.gsmid_index)
         region = torch.from_numpy(self.region[index, :])
         return {"input_ids": data, "position_ids": gsmid, "region": region, "sequence":torch.tensor([])}
@@ -226,8 +392,11 @@ class RowResampleDataset(BasicDataset):
     def __len__(self):
         return self.resample_len
     
+    def _raw_index(self, index):
+        return self.index_dict[index]
+
     def __getitem__(self, index):
-        raw_index = self.index_dict[index]
+        raw_index = self._raw_index(index)
         item = super().__getitem__(raw_index)
         return item
 
@@ -399,6 +568,51 @@ class SampleDataset(MaskDataset):
             return item
 
 
+class BlockBatchSampler(Sampler):
+    def __init__(self, data_len, batch_size, block_size = 16, fetch_factor = 1, shuffle = True, drop_last = False):
+        '''
+        BlockBatchSampler yields minibatches of indices drawn from contiguous row blocks, so that each minibatch reads nearby hdf5 rows.
+        Blocks are shuffled, then fetch_factor minibatches worth of rows are gathered, shuffled in memory and split into minibatches.
+        data_len: int, length of the dataset
+        batch_size: int, size of each minibatch
+        block_size: int = 16, rows per contiguous block
+        fetch_factor: int = 1, minibatches gathered per fetch
+        shuffle: bool = True, shuffle blocks and rows within each fetch
+        drop_last: bool = False, drop the last incomplete minibatch
+        '''
+        if not isinstance(data_len, (int, np.integer)):
+            raise(TypeError(f"BlockBatchSampler takes the dataset length, not {type(data_len)}; it can not wrap a sampler such as DistributedSampler"))
+        self.data_len = data_len
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.fetch_factor = fetch_factor
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        block_starts = np.arange(0, self.data_len, self.block_size)
+        if self.shuffle:
+            np.random.shuffle(block_starts)
+        index = (block_starts[:, None] + np.arange(self.block_size)).ravel()
+        index = index[index < self.data_len]
+
+        fetch_size = self.batch_size * self.fetch_factor
+        for start in range(0, len(index), fetch_size):
+            fetched = index[start:start + fetch_size]
+            if self.shuffle:
+                fetched = np.random.permutation(fetched)
+            for i in range(0, len(fetched), self.batch_size):
+                batch = fetched[i:i + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.data_len // self.batch_size
+        return (self.data_len + self.batch_size - 1) // self.batch_size
+
+
 class LitChromBERTDataModule(LightningDataModule):
     def __init__(self, config = None, train_params = {},val_params = dict(), test_params = dict(), **params):
         '''
@@ -410,12 +624,12 @@ class LitChromBERTDataModule(LightningDataModule):
 
         '''
         self.basic_config = DatasetConfig(config, **params)
-        self.train_config = DatasetConfig(config=self.basic_config, **train_params)
-        self.val_config = DatasetConfig(config=self.basic_config, **val_params)
-        self.test_config = DatasetConfig(config=self.basic_config, **test_params)
+        self.train_config = self.basic_config.clone(**train_params)
+        self.val_config = self.basic_config.clone(**val_params)
+        self.test_config = self.basic_config.clone(**test_params)
 
         assert self.train_config.dataset_class == self.val_config.dataset_class == self.test_config.dataset_class
-        self.dataset_class = eval(self.basic_config.dataset_class)
+        self.dataset_class = _get_dataset_cls(self.basic_config.dataset_class)
 
         self.current_train_config = self.train_config.clone()
         self.current_val_config = self.val_config.clone()
@@ -440,18 +654,34 @@ class LitChromBERTDataModule(LightningDataModule):
 
 
 
+    @staticmethod
+    def init_dataloader(dataset, config, shuffle):
+        config.validate()
+        if config.num_workers > 0:
+            worker_params = dict(persistent_workers=config.persistent_workers, prefetch_factor=config.prefetch_factor)
+        else:
+            worker_params = dict()
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        dataset.block_reads = config.fetch_factor > 1 and not distributed
+        if config.fetch_factor > 1 and distributed:
+            print("Warning: block sampling (fetch_factor > 1) is not supported in distributed runs, falling back to the default sampler")
+        if dataset.block_reads:
+            batch_sampler = BlockBatchSampler(len(dataset), config.batch_size, block_size=config.block_size, fetch_factor=config.fetch_factor, shuffle=shuffle)
+            return DataLoader(dataset, batch_sampler=batch_sampler, num_workers=config.num_workers, **worker_params)
+        return DataLoader(dataset, batch_size=config.batch_size, shuffle=shuffle, num_workers=config.num_workers, **worker_params)
+
     def train_dataloader(self):
-        dl = DataLoader(self.train_dataset, batch_size=self.train_config.batch_size, shuffle=True, num_workers=0)
+        dl = self.init_dataloader(self.train_dataset, self.train_config, shuffle=True)
         self.num_train_epochs = len(dl)
         return dl
     
     def val_dataloader(self):
-        dl = DataLoader(self.val_dataset, batch_size=self.val_config.batch_size, shuffle=True, num_workers=0)
+        dl = self.init_dataloader(self.val_dataset, self.val_config, shuffle=True)
         self.num_val_epochs = len(dl)
         return dl
     
     def test_dataloader(self):
-        dl = DataLoader(self.test_dataset, batch_size=self.test_config.batch_size, shuffle=False, num_workers=0)
+        dl = self.init_dataloader(self.test_dataset, self.test_config, shuffle=False)
         self.num_test_epochs = len(dl)
         return dl
     
@@ -0,0 +1,173 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+h5py = pytest.importorskip("h5py")
+torch = pytest.importorskip("torch")
+dataset = pytest.importorskip("chrombert.dataset")
+
+
+@pytest.fixture
+def hdf5_file(tmp_path):
+    n_rows, n_gsmids = 53, 7
+    rng = np.random.RandomState(0)
+    path = tmp_path / "cistrome.h5"
+    with h5py.File(path, "w") as f:
+        signal = f.create_dataset("/train/signal", data=rng.randint(0, 5, size=(n_rows, n_gsmids)).astype(np.int64))
+        signal.attrs["shape"] = (n_rows, n_gsmids)
+        f.create_dataset("/train/GSMID", data=np.array([f"GSM{i}".encode() for i in range(n_gsmids)]))
+        f.create_dataset("/train/region", data=np.arange(n_rows * 3).reshape(n_rows, 3))
+        f.create_dataset("/train/ratio", data=rng.rand(n_rows, 5))
+    return str(path)
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_block_batch_sampler_covers_dataset(shuffle, drop_last):
+    sampler = dataset.BlockBatchSampler(103, 8, block_size=4, fetch_factor=3, shuffle=shuffle, drop_last=drop_last)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert all(len(batch) == 8 for batch in batches[:-1])
+    flat = sorted(index for batch in batches for index in batch)
+    if drop_last:
+        assert len(flat) == 103 // 8 * 8
+        assert len(set(flat)) == len(flat)
+    else:
+        assert flat == list(range(103))
+
+
+def test_block_batch_sampler_rejects_sampler():
+    with pytest.raises(TypeError):
+        dataset.BlockBatchSampler(range(10), 2)
+
+
+@pytest.mark.parametrize("dataset_cls", ["BasicDataset", "RowResampleDataset"])
+def test_getitems_matches_getitem(hdf5_file, dataset_cls):
+    cls = getattr(dataset, dataset_cls)
+    params = dict(resample_row_degree=0.5, deterministic=True) if dataset_cls == "RowResampleDataset" else dict()
+    reference = cls(config=None, hdf5_file=hdf5_file, **params)
+    blocked = cls(config=None, hdf5_file=hdf5_file, fetch_factor=2, block_size=4, **params)
+    blocked.block_reads = True
+    assert len(reference) == len(blocked)
+
+    indices = [7, 0, 3, len(blocked) - 1, 3, 12]
+    for expected, item in zip([reference[i] for i in indices], blocked.__getitems__(indices)):
+        assert expected.keys() == item.keys()
+        for key in expected:
+            assert torch.equal(expected[key], item[key])
+
+
+class CountingSignal:
+    def __init__(self, signal):
+        self.signal = signal
+        self.calls = 0
+        self.rows = 0
+
+    def __getitem__(self, key):
+        rows = self.signal[key]
+        self.calls += 1
+        self.rows += rows.shape[0] if rows.ndim == 2 else 1
+        return rows
+
+
+def test_getitems_random_batch_reads_each_row_once(hdf5_file):
+    ds = dataset.BasicDataset(config=None, hdf5_file=hdf5_file, fetch_factor=4, block_size=4)
+    with h5py.File(hdf5_file, "r") as f:
+        signal = CountingSignal(f["/train/signal"][:])
+    ds.dataset = {"signal": signal}
+    # a random-order batch, as handed out by the default shuffled sampler
+    indices = np.random.RandomState(1).permutation(len(ds))[:16].tolist()
+    ds.__getitems__(indices)
+    assert signal.calls == len(indices)
+    assert signal.rows == len(indices)
+
+
+def test_init_dataloader_enables_block_reads(hdf5_file):
+    ds = dataset.BasicDataset(config=None, hdf5_file=hdf5_file, fetch_factor=4, block_size=4)
+    dataset.LitChromBERTDataModule.init_dataloader(ds, ds.config, shuffle=True)
+    assert ds.block_reads
+    ds.config.fetch_factor = 1
+    dataset.LitChromBERTDataModule.init_dataloader(ds, ds.config, shuffle=True)
+    assert not ds.block_reads
+
+
+def test_cached_rows_are_not_aliased(hdf5_file):
+    ds = dataset.BasicDataset(config=None, hdf5_file=hdf5_file, hdf5_row_cache_size=8)
+    expected = ds[4]["input_ids"].clone()
+    ds[4]["input_ids"] += 100
+    assert torch.equal(ds[4]["input_ids"], expected)
+
+
+def test_validate_ignores_unused_ignore_gsmids(hdf5_file, tmp_path):
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file, ignore_gsmids=str(tmp_path / "missing.csv"))
+    config.validate()
+    with pytest.raises(FileNotFoundError):
+        config.clone(ignore_factor=True).validate()
+
+
+def test_clone_does_not_share_vocab_ids(hdf5_file):
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file)
+    clone = config.clone()
+    assert clone == config
+    assert clone.normal_vocab_ids == config.normal_vocab_ids
+    assert clone.normal_vocab_ids is not config.normal_vocab_ids
+    assert clone.special_vocab_ids is not config.special_vocab_ids
+
+
+def test_save_load_round_trip(hdf5_file, tmp_path):
+    config = dataset.DatasetConfig(
+        hdf5_file=hdf5_file,
+        resample_col_degree=np.float64(0.5),
+        resample_row_threshold=float("inf"),
+        mask_ratio=float("nan"),
+        sub_prob=float("-inf"),
+    )
+    str(config)
+    config_file = str(tmp_path / "config.json")
+    config.save(config_file)
+    loaded = dataset.DatasetConfig(config_file)
+    assert loaded.resample_col_degree == 0.5
+    assert loaded.resample_row_threshold == float("inf")
+    assert loaded.sub_prob == float("-inf")
+    assert np.isnan(loaded.mask_ratio)
+
+
+def test_validate_detects_deleted_hdf5_file(hdf5_file):
+    dataset.DatasetConfig(hdf5_file=hdf5_file).validate()
+    os.remove(hdf5_file)
+    with pytest.raises(FileNotFoundError):
+        dataset.DatasetConfig(hdf5_file=hdf5_file).validate()
+
+
+def test_bad_dataset_class_raises_only_on_use(hdf5_file):
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file, dataset_class="NotADataset")
+    with pytest.raises(ValueError):
+        config.validate()
+    with pytest.raises(ValueError):
+        dataset.BasicDataset(config=None, hdf5_file=hdf5_file, dataset_class="NotADataset")
+
+
+def test_update_hdf5_file_rearms_validation(hdf5_file, tmp_path):
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file)
+    config.validate()
+    config.update(hdf5_file=str(tmp_path / "missing.h5"))
+    with pytest.raises(FileNotFoundError):
+        config.validate()
+
+
+def test_update_other_field_keeps_validation(hdf5_file):
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file)
+    config.validate()
+    os.remove(hdf5_file)
+    config.update(batch_size=4)
+    config.validate()
+
+
+def test_skip_validate_env(hdf5_file, monkeypatch):
+    monkeypatch.setenv("CHROMBERT_SKIP_VALIDATE", "1")
+    config = dataset.DatasetConfig(hdf5_file=hdf5_file, dataset_class="NotADataset")
+    config.validate()
+    monkeypatch.delenv("CHROMBERT_SKIP_VALIDATE")
+    with pytest.raises(ValueError):
+        config.validate()